@@ -1,34 +1,148 @@
 """
 Audio analysis and slice preview/export helpers.
+- load: decode once through ffmpeg and cache the float samples
 - analyze_onsets: detect slices (onset detection via librosa)
-- preview_slice: play a slice using pydub (requires ffmpeg)
+- preview_slice: play a slice through ffplay (requires ffmpeg)
 - extract_slice_samples: return numpy PCM data for a slice
 """
 import numpy as np
 from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+from pydub.utils import mediainfo
 import librosa
-import soundfile as sf
 import tempfile
 import os
-import sys
 import math
+import struct
 import subprocess
+import threading
+
+def float_to_pcm16(y, out=None):
+    """
+    Convert float samples in [-1,1] to int16 with a single scratch buffer:
+    scale into it, round and saturate in place, then one casting copy into the output.
+    Rounding (rather than the cast's truncation toward zero) avoids a DC bias.
+    out: optional preallocated int16 array of y's shape to write into.
+    """
+    tmp = np.multiply(y, 32767.0, dtype=np.float32)
+    np.rint(tmp, out=tmp)
+    np.clip(tmp, -32768.0, 32767.0, out=tmp)
+    pcm = np.empty(tmp.shape, dtype=np.int16) if out is None else out
+    np.copyto(pcm, tmp, casting='unsafe')
+    return pcm
+
+def slice_bounds(n_frames, sr, slice_tuple):
+    """
+    Frame range [i0, i1) covered by (start_sec, end_sec), clamped to n_frames.
+    """
+    start, end = slice_tuple
+    i0 = min(int(start * sr), n_frames)
+    i1 = max(i0, min(int(end * sr), n_frames))
+    return i0, i1
+
+def slice_pcm(y, sr, slice_tuple, out=None):
+    """
+    Cut (start_sec, end_sec) out of decoded float samples y and return mono int16 PCM.
+    out: optional int16 array of the slice's length (see slice_bounds) to write into.
+    """
+    i0, i1 = slice_bounds(y.shape[-1], sr, slice_tuple)
+    # y[..., i0:i1] is a view, so the decoded buffer is never modified
+    seg = y[..., i0:i1]
+    if seg.ndim == 1:
+        return float_to_pcm16(seg, out=out)
+    # If not mono, mix down to shape (n,)
+    pcm = np.mean(float_to_pcm16(seg), axis=0).astype(np.int16)
+    if out is not None:
+        out[...] = pcm
+        pcm = out
+    return pcm
+
+# canonical 44-byte PCM WAV header
+_WAV_HDR = struct.Struct("<4sI4s4sIHHIIHH4sI")
 
 class AudioConverter:
+    def __init__(self):
+        # decoded audio keyed by (mp3_path, sr, mono) -> (y, sr_actual)
+        self._cache = {}
+        # serializes decodes so concurrent slice workers share a single one
+        self._cache_lock = threading.Lock()
+        # pydub segments keyed by (mp3_path, mtime) for previews
+        self._seg_cache = {}
+        # ffplay process of the preview currently playing, if any; guarded by _preview_lock
+        self._preview_proc = None
+        self._preview_lock = threading.Lock()
+
+    def reset(self):
+        """
+        Drop every cached decode; call when switching to another file.
+        """
+        with self._cache_lock:
+            self._cache.clear()
+            self._seg_cache.clear()
+
+    def load(self, mp3_path, sr=22050, mono=True):
+        """
+        Decode the file once and memoize the float32 samples.
+        Returns (y, sr_actual); y must be treated as read-only by callers.
+        """
+        key = (mp3_path, sr, mono)
+        with self._cache_lock:
+            if key not in self._cache:
+                self._cache[key] = self._decode(mp3_path, sr, mono)
+            return self._cache[key]
+
+    def _decode(self, mp3_path, sr, mono):
+        """
+        Decode with ffmpeg straight to float32; ffmpeg resamples/downmixes
+        (libswresample) on the way out. Returns float32 samples, nominally in [-1,1],
+        shaped like librosa.load: (n,) or (channels, n).
+        """
+        if sr is None or not mono:
+            # the output rate/layout must be known to interpret the raw stream
+            info = mediainfo(mp3_path)
+            if sr is None:
+                sr = int(info['sample_rate'])
+            channels = 1 if mono else int(info['channels'])
+        else:
+            channels = 1
+        # called directly: output options must precede the output "-", and
+        # pydub's from_file(parameters=...) appends them after it, where ffmpeg ignores them
+        cmd = [AudioSegment.converter, "-nostdin", "-v", "error", "-i", mp3_path, "-vn",
+               "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sr), "-"]
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0:
+            raise CouldntDecodeError("Decoding failed. ffmpeg returned error code: %d\n\n%s"
+                                     % (p.returncode, p.stderr.decode(errors='replace')))
+        y = np.frombuffer(p.stdout, dtype='<f4')
+        if channels > 1:
+            y = y[:len(y) - len(y) % channels].reshape(-1, channels).T
+        return y, sr
+
+    def _get_segment(self, mp3_path):
+        """
+        Return the decoded AudioSegment for mp3_path, re-decoding only if the file changed.
+        """
+        key = (mp3_path, os.path.getmtime(mp3_path))
+        if key not in self._seg_cache:
+            self._seg_cache[key] = AudioSegment.from_file(mp3_path)
+        return self._seg_cache[key]
+
     def analyze_onsets(self, mp3_path, sr=22050, mono=True, hop_length=512):
         """
-        Load file and detect onsets. Returns list of (start_sec, end_sec).
+        Load file and detect onsets. Returns (slices, y, sr_actual) where slices is a
+        list of (start_sec, end_sec) and y is the decoded audio, so callers can cut
+        samples from it without decoding again.
         We'll create slices between onsets; the last slice ends at audio end.
         """
-        y, sr_actual = librosa.load(mp3_path, sr=sr, mono=mono)
-        onsets = librosa.onset.onset_detect(y=y, sr=sr_actual, hop_length=hop_length, backtrack=True)
-        times = librosa.frames_to_time(onsets, sr=sr_actual, hop_length=hop_length)
-        times = list(times)
+        y, sr_actual = self.load(mp3_path, sr=sr, mono=mono)
+        onsets = librosa.onset.onset_detect(y=librosa.to_mono(y), sr=sr_actual, hop_length=hop_length, backtrack=True)
+        # onset_detect returns a plain [] for silent input
+        times = (np.asarray(onsets) * (hop_length / float(sr_actual))).tolist()
         # ensure start at 0
         if not times or times[0] > 0.05:
             times.insert(0, 0.0)
         # append end
-        duration = librosa.get_duration(y=y, sr=sr_actual)
+        duration = y.shape[-1] / float(sr_actual)
         if not times or abs(times[-1] - duration) > 0.05:
             times.append(duration)
         slices = []
@@ -38,54 +152,96 @@ class AudioConverter:
             # filter very small slices
             if end - start >= 0.025:
                 slices.append((start, end))
-        return slices
+        return slices, y, sr_actual
+
+    def _cached_decode(self, mp3_path):
+        """
+        Return any (y, sr) already decoded for mp3_path, or None.
+        """
+        with self._cache_lock:
+            for (path, _, _), decoded in self._cache.items():
+                if path == mp3_path:
+                    return decoded
+        return None
 
     def preview_slice(self, mp3_path, slice_tuple):
         """
-        Play a slice quickly using pydub AudioSegment (blocks until complete).
+        Start playing a slice by piping its raw PCM to ffplay and return without waiting;
+        any preview still playing is stopped first (see cancel_preview).
+        Reuses the analysis decode when there is one, so previews do not decode again.
         """
+        decoded = self._cached_decode(mp3_path)
+        if decoded is not None:
+            y, sr = decoded
+            pcm = slice_pcm(y, sr, slice_tuple).astype('<i2', copy=False)
+            self._play_raw(pcm.tobytes(), sr, 1)
+            return
         start, end = slice_tuple
-        seg = AudioSegment.from_file(mp3_path)
+        seg = self._get_segment(mp3_path)
         ms_start = int(start * 1000)
         ms_end = int(end * 1000)
-        chunk = seg[ms_start:ms_end]
-        # play - pydub doesn't include player; use simple temporary export to play via default system player
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        tmp.close()
-        chunk.export(tmp.name, format="wav")
-        # open using system default player (blocking)
-        if sys.platform.startswith("darwin"):
-            subprocess.call(["afplay", tmp.name])
-        elif sys.platform.startswith("linux"):
-            # try aplay (may not exist), else use ffplay
+        # 8-bit WAV data is unsigned; normalise everything to s16le for ffplay
+        chunk = seg[ms_start:ms_end].set_sample_width(2)
+        self._play_raw(chunk.raw_data, chunk.frame_rate, chunk.channels)
+
+    def _play_raw(self, raw, sr, channels):
+        """
+        Stream interleaved 16-bit signed little-endian PCM to ffplay over stdin in the background.
+        """
+        # cancel + start + record as one step, so concurrent previews never orphan a player
+        with self._preview_lock:
+            self._cancel_preview_locked()
+            p = subprocess.Popen(["ffplay", "-autoexit", "-nodisp", "-loglevel", "quiet",
+                                  "-f", "s16le", "-ar", str(sr), "-ac", str(channels), "-"],
+                                 stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._preview_proc = p
+        def feed():
             try:
-                subprocess.call(["aplay", tmp.name])
-            except:
-                subprocess.call(["ffplay", "-nodisp", "-autoexit", tmp.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        elif sys.platform.startswith("win"):
-            # use PowerShell to play
-            subprocess.call(["powershell", "-c", f"(New-Object Media.SoundPlayer '{tmp.name}').PlaySync();"])
-        else:
-            # fallback to ffplay
-            subprocess.call(["ffplay", "-nodisp", "-autoexit", tmp.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        os.unlink(tmp.name)
+                p.stdin.write(raw)
+            except OSError:
+                # player was cancelled or exited early
+                pass
+            finally:
+                try:
+                    p.stdin.close()
+                except OSError:
+                    pass
+            p.wait()
+        threading.Thread(target=feed, daemon=True).start()
+
+    def cancel_preview(self):
+        """
+        Stop the preview started by preview_slice, if it is still playing.
+        """
+        with self._preview_lock:
+            self._cancel_preview_locked()
+
+    def _cancel_preview_locked(self):
+        p = self._preview_proc
+        self._preview_proc = None
+        if p is not None and p.poll() is None:
+            p.kill()
+            p.wait()
 
     def extract_slice_samples(self, mp3_path, slice_tuple, sr=22050, mono=True):
         """
         Return a numpy int16 array of PCM samples for the requested slice, resampled to sr.
         """
-        start, end = slice_tuple
-        y, sr_actual = librosa.load(mp3_path, sr=sr, mono=mono, offset=start, duration=(end-start))
-        # convert float32 in [-1,1] to int16
-        y = np.clip(y, -1.0, 1.0)
-        pcm = (y * 32767.0).astype(np.int16)
-        # If mono, ensure shape (n,)
-        if pcm.ndim > 1:
-            pcm = np.mean(pcm, axis=0).astype(np.int16)
-        return pcm, sr
+        # slice the cached decode instead of re-decoding up to `start` for every slice
+        y, sr_actual = self.load(mp3_path, sr=sr, mono=mono)
+        return slice_pcm(y, sr_actual, slice_tuple), sr_actual
 
     def write_wav_temp(self, pcm, sr):
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        tmp.close()
-        sf.write(tmp.name, pcm.astype('int16'), sr, subtype='PCM_16')
-        return tmp.name
\ No newline at end of file
+        """
+        Write int16 PCM, shaped (n,) or (n, channels), to a temporary 16-bit WAV and return its path.
+        """
+        if pcm.dtype != np.int16:
+            pcm = pcm.astype(np.int16)
+        channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+        data = np.ascontiguousarray(pcm, dtype='<i2').tobytes()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+            tmp.write(_WAV_HDR.pack(b"RIFF", 36 + len(data), b"WAVE", b"fmt ", 16,
+                                    1, channels, sr, sr * channels * 2, channels * 2, 16,
+                                    b"data", len(data)))
+            tmp.write(data)
+        return tmp.name
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Simple Tk GUI: load MP3, analyze, preview slices, auto-remix, export .xm
-Prototype — depends on pydub, librosa, soundfile, numpy
+Prototype — depends on pydub, librosa, numpy
 """
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
@@ -43,6 +43,9 @@ class App:
         self.preview_btn = ttk.Button(btn_frame, text="Preview Slice", command=self.preview_slice, state="disabled")
         self.preview_btn.pack(side="left", padx=6)
 
+        self.stop_btn = ttk.Button(btn_frame, text="Stop", command=self.stop_preview, state="disabled")
+        self.stop_btn.pack(side="left", padx=6)
+
         # Settings
         settings = ttk.LabelFrame(frm, text="Settings")
         settings.pack(fill="x", pady=(0,10))
@@ -76,6 +79,8 @@ class App:
 
         self.loaded_path = None
         self.slices = []
+        # (y, sr) decoded by the last analysis, reused when generating the remix
+        self.decoded = None
         self.remix_plan = None
 
     def set_status(self, text):
@@ -86,14 +91,20 @@ class App:
         path = filedialog.askopenfilename(title="Select MP3", filetypes=[("MP3 files","*.mp3"), ("All files","*.*")])
         if not path:
             return
+        self.converter.cancel_preview()
         self.loaded_path = path
         self.set_status(f"Loaded: {os.path.basename(path)}")
         self.analyze_btn.config(state="normal")
         self.remix_btn.config(state="disabled")
         self.export_btn.config(state="disabled")
         self.preview_btn.config(state="disabled")
+        self.stop_btn.config(state="disabled")
         self.slice_list.delete(0, tk.END)
         self.slices = []
+        self.decoded = None
+        # keep only the current file's decodes
+        self.converter.reset()
+        self.remixer.conv.reset()
 
     def analyze(self):
         if not self.loaded_path:
@@ -105,8 +116,9 @@ class App:
             try:
                 sr = int(self.sr_var.get())
                 ch = int(self.ch_var.get())
-                slices = self.converter.analyze_onsets(self.loaded_path, sr=sr, mono=(ch==1))
+                slices, y, sr_actual = self.converter.analyze_onsets(self.loaded_path, sr=sr, mono=(ch==1))
                 self.slices = slices
+                self.decoded = (y, sr_actual)
                 self.slice_list.delete(0, tk.END)
                 for i, s in enumerate(slices):
                     start, end = s
@@ -114,6 +126,7 @@ class App:
                 self.set_status(f"Analysis complete: {len(slices)} slices")
                 self.remix_btn.config(state="normal" if slices else "disabled")
                 self.preview_btn.config(state="normal" if slices else "disabled")
+                self.stop_btn.config(state="normal" if slices else "disabled")
             except Exception as e:
                 messagebox.showerror("Error analyzing audio", str(e))
                 self.set_status("Error during analysis")
@@ -131,13 +144,18 @@ class App:
         self.set_status(f"Previewing slice {idx}...")
         def work():
             try:
+                # returns once playback has started; the player runs in the background
                 self.converter.preview_slice(self.loaded_path, slice_info)
-                self.set_status("Preview finished")
+                self.set_status(f"Playing slice {idx}")
             except Exception as e:
                 messagebox.showerror("Preview error", str(e))
                 self.set_status("Preview error")
         threading.Thread(target=work, daemon=True).start()
 
+    def stop_preview(self):
+        self.converter.cancel_preview()
+        self.set_status("Preview stopped")
+
     def generate_remix(self):
         if not self.slices:
             messagebox.showerror("No slices", "Analyze the audio first.")
@@ -152,7 +170,7 @@ class App:
             bpm = None
         self.set_status("Generating remix plan...")
         try:
-            plan = self.remixer.generate_plan(self.loaded_path, self.slices, bpm=bpm)
+            plan = self.remixer.generate_plan(self.loaded_path, self.slices, bpm=bpm, decoded=self.decoded)
             self.remix_plan = plan
             # display plan summary in list
             self.slice_list.delete(0, tk.END)
@@ -4,8 +4,10 @@ Simple remixer:
 - export_xm: assembles samples and pattern data and writes XM via xm_writer
 """
 import numpy as np
-from xm_writer import XMWriter
-from converter import AudioConverter
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from xm_writer import XMWriter, new_patterns, CELL_FULL
+from converter import AudioConverter, slice_bounds, slice_pcm
 
 # Simple mapping: assign each slice to a note in a scale.
 BASE_NOTE = 48  # C-4 in XM period table mapping we will use as note numbers (1..96 range in XM)
@@ -15,12 +17,16 @@ class AutoRemixer:
     def __init__(self):
         self.conv = AudioConverter()
 
-    def generate_plan(self, mp3_path, slices, bpm=None):
+    def generate_plan(self, mp3_path, slices, bpm=None, decoded=None):
         """
         Create a simple plan: for each slice, pick a pitch (cycle through scale),
         assign to a pattern and row. Return a plan containing notes and pattern structure.
+        decoded: optional (y, sr) as returned by AudioConverter.analyze_onsets; when
+        omitted the file is decoded (once) at 22050 Hz mono.
         plan = {
-            'samples': [ { 'slice_idx': int, 'sample_data': np.int16, 'sr': int } ],
+            'samples': [ (offset, length) ... ] into sample_store, one per slice,
+            'sample_store': np.memmap of int16 PCM backing every sample,
+            'sr': int,
             'notes': [ (slice_idx, note_number, pattern_index, row) ... ],
             'patterns_count': n,
             'channels': 4,
@@ -28,11 +34,24 @@ class AutoRemixer:
         }
         """
         samples = []
-        notes = []
-        # collect samples (convert slices to raw PCM)
-        for i, s in enumerate(slices):
-            pcm, sr = self.conv.extract_slice_samples(mp3_path, s, sr=22050, mono=True)
-            samples.append({'slice_idx': i, 'pcm': pcm, 'sr': sr})
+        if decoded is None:
+            decoded = self.conv.load(mp3_path, sr=22050, mono=True)
+        y, sr = decoded
+        # collect samples (convert slices to raw PCM) into one memory-mapped store
+        # instead of one in-memory array per slice
+        total = 0
+        for s in slices:
+            i0, i1 = slice_bounds(y.shape[-1], sr, s)
+            samples.append((total, i1 - i0))
+            total += i1 - i0
+        # np.memmap cannot map an empty file
+        store = np.memmap(tempfile.TemporaryFile(), dtype=np.int16, mode='w+', shape=(max(total, 1),))
+        # workers only slice and convert, which NumPy does outside the GIL
+        def extract(i):
+            off, n = samples[i]
+            slice_pcm(y, sr, slices[i], out=store[off:off + n])
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            list(ex.map(extract, range(len(slices))))
 
         # decide channels and patterns
         channels = 4
@@ -40,17 +59,19 @@ class AutoRemixer:
         rows_per_pattern = 64
 
         # map slices to notes across patterns somewhat musically
-        for i, sample_info in enumerate(samples):
-            # pitch selection: cycle through SCALE_STEPS in successive octaves
-            step = SCALE_STEPS[i % len(SCALE_STEPS)]
-            octave = (i // len(SCALE_STEPS))  # 0,1,...
-            note = BASE_NOTE + step + octave*12
-            pat = (i % patterns_count)
-            row = (i * 8) % rows_per_pattern
-            notes.append((sample_info['slice_idx'], note, pat, row))
+        i = np.arange(len(samples))
+        # pitch selection: cycle through SCALE_STEPS in successive octaves
+        step = np.take(SCALE_STEPS, i % len(SCALE_STEPS))
+        octave = i // len(SCALE_STEPS)  # 0,1,...
+        note = BASE_NOTE + step + octave*12
+        pat = i % patterns_count
+        row = (i * 8) % rows_per_pattern
+        notes = list(zip(i.tolist(), note.tolist(), pat.tolist(), row.tolist()))
 
         plan = {
             'samples': samples,
+            'sample_store': store,
+            'sr': sr,
             'notes': notes,
             'patterns_count': patterns_count,
             'channels': channels,
@@ -64,38 +85,35 @@ class AutoRemixer:
         Build an XM using XMWriter. For each sample in plan, add as an instrument sample.
         Pattern data is assembled using simple note placements without effects.
         """
-        # assemble sample list (the XMWriter will expect 16-bit PCM np arrays)
-        samples = []
-        for s in plan['samples']:
-            # ensure sample has requested sr and mono; our extractor already resampled
-            pcm = s['pcm']
-            samples.append(pcm)
+        # assemble sample list as views of the plan's store (the XMWriter expects 16-bit PCM np arrays);
+        # our extractor already resampled
+        store = plan['sample_store']
+        samples = [store[off:off + n] for off, n in plan['samples']]
 
-        # create pattern matrix: patterns_count x rows x channels of note dicts
-        patterns = []
+        # create pattern matrix: patterns_count x rows x channels cells
         patterns_count = plan['patterns_count']
         rows = plan['rows_per_pattern']
         channels = plan['channels']
         # initialize empty
-        for _ in range(patterns_count):
-            pat = [[None for _ in range(channels)] for _ in range(rows)]
-            patterns.append(pat)
-        # fill notes
-        for note in plan['notes']:
-            slice_idx, note_num, pat_idx, row = note
-            # pick channel round-robin by slice_idx
-            ch = slice_idx % channels
-            # XM note numbers are 1..96 typically; cap for safety
-            note_field = int(max(1, min(96, note_num)))
-            # sample number in XM is 1-based; we use slice_idx+1
-            pat = patterns[pat_idx]
-            pat[row][ch] = {
-                'note': note_field,
-                'instrument': slice_idx + 1,
-                'volume': 64,  # 0-64
-                'effect': 0,
-                'effect_param': 0
-            }
+        patterns = new_patterns(patterns_count, rows, channels)
+        # fill notes with one scatter per field instead of a Python loop over cells
+        notes = np.asarray(plan['notes'], dtype=np.int64).reshape(-1, 4)
+        slice_idx, note_num, pat_idx, row = notes.T
+        # pick channel round-robin by slice_idx
+        ch = slice_idx % channels
+        cell = np.ravel_multi_index((pat_idx, row, ch), patterns.shape)
+        # when notes share a cell the later one wins, as with sequential placement
+        _, last = np.unique(cell[::-1], return_index=True)
+        keep = len(cell) - 1 - last
+        cells = patterns.reshape(-1)
+        cell = cell[keep]
+        cells['flag'][cell] = CELL_FULL
+        # XM note numbers are 1..96 typically; cap for safety
+        cells['note'][cell] = np.clip(note_num[keep], 1, 96)
+        # sample number in XM is 1-based; we use slice_idx+1
+        cells['instr'][cell] = (slice_idx[keep] + 1) & 0xFF
+        cells['vol'][cell] = 64  # 0-64
+        # effect and effect param stay 0
 
         # use XMWriter to write module
         writer = XMWriter()
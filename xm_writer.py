@@ -5,7 +5,7 @@ This writes a simple XM file following the XM format structure enough for basic
 - Single module header
 - N patterns with typically 64 rows
 - N instruments; each instrument contains one sample
-- Sample data uses 16-bit signed PCM little-endian
+- Sample data uses 16-bit signed PCM little-endian, delta-encoded as the format requires
 
 Important limitations:
 - Instruments have no envelopes
@@ -17,160 +17,136 @@ complex trackers may require more fields.
 """
 
 import struct
-import io
 import numpy as np
 
-def _write_fixed_string(f, s, length):
-    b = s.encode('ascii', errors='replace')[:length]
-    b += b'\x00' * (length - len(b))
-    f.write(b)
+# One pattern cell as laid out in the packed pattern stream. A cell whose
+# flag has the high bit clear is empty and is emitted as its flag byte only.
+CELL_DTYPE = np.dtype([('flag', 'u1'), ('note', 'u1'), ('instr', 'u1'),
+                       ('vol', 'u1'), ('eff', 'u1'), ('effp', 'u1')])
+
+# flag for a full cell: note, instrument, volume column and effect present
+CELL_FULL = 0x80 | 0x01 | 0x02 | 0x04 | 0x08
+
+def new_patterns(count, rows, channels):
+    """Return count empty patterns as one (count, rows, channels) array."""
+    return np.zeros((count, rows, channels), dtype=CELL_DTYPE)
+
+def _pack_pattern(pat, channels):
+    """
+    Encode a (rows, n) CELL_DTYPE array into packed pattern bytes for `channels` channels.
+    Channels the pattern lacks are written as empty cells, extra columns are ignored,
+    so every row always holds exactly `channels` cells.
+    Row-major order matches XM; empty cells keep only their flag byte.
+    """
+    if pat.shape[1] < channels:
+        full = np.zeros((pat.shape[0], channels), dtype=CELL_DTYPE)
+        full[:, :pat.shape[1]] = pat
+        pat = full
+    cells = np.ascontiguousarray(pat[:, :channels]).view(np.uint8).reshape(-1, CELL_DTYPE.itemsize)
+    keep = np.zeros(cells.shape, dtype=bool)
+    keep[:, 0] = True
+    keep[(cells[:, 0] & 0x80) != 0, 1:] = True
+    return cells[keep].tobytes()
+
+# instrument header: name, type, number of samples, sample header size, 96 zeroed envelope bytes
+_INSTR_HDR = struct.Struct("<22sBHI96x")
+# sample header: length, loop start, loop length, volume, finetune, type, panning,
+# relative note, reserved, name (40 bytes)
+_SAMPLE_HDR = struct.Struct("<IIIBbBBbB22s")
+
+# module header: id text, song name, 0x1A, tracker name, header size, song length,
+# restart position, channels, patterns, instruments, flags, tempo, bpm, order table
+_MODULE_HDR = struct.Struct("<17s20sB20sIHHHHHHHH256s")
+# pattern header: header length, rows, packed data size
+_PATTERN_HDR = struct.Struct("<IHH")
+
+def _fixed_string(s):
+    return s.encode('ascii', errors='replace')
+
+def _delta_encode(pcm):
+    """
+    Delta-encode 16-bit PCM as XM stores it: first value as-is, then successive
+    differences. int16 subtraction wraps, which is what the decoder's running sum expects.
+    """
+    pcm = np.asarray(pcm, dtype='<i2')
+    delta = np.empty_like(pcm)
+    if pcm.size:
+        delta[0] = pcm[0]
+        np.subtract(pcm[1:], pcm[:-1], out=delta[1:])
+    return delta
 
 class XMWriter:
     def write_xm(self, out_path, song_name, samples, patterns, channels=4, tempo=125, bpm=6):
         """
         samples: list of numpy.int16 arrays (PCM)
-        patterns: list of patterns, each pattern is rows x channels, where each cell is either None or dict:
-            { 'note': int (1..96), 'instrument': int (1-based), 'volume': 0..64, 'effect': 0..255, 'effect_param': 0..255 }
+        patterns: sequence of patterns, each a (rows, channels) CELL_DTYPE array (see new_patterns);
+            a cell is empty when its flag is 0, otherwise flag is CELL_FULL and
+            note (1..96), instr (1-based), vol (0..64), eff and effp (0..255) are written
         channels: number of channels (max 32 recommended)
         """
-        with open(out_path, "wb") as f:
-            # Header: ID text "Extended Module: " 17 bytes
-            f.write(b"Extended Module: ")  # 17 bytes literal
-            _write_fixed_string(f, song_name, 20)
-            f.write(bytes([0x1A]))  # 0x1A
-            _write_fixed_string(f, "PythonXMWriter", 20)  # tracker name
-            # header size (fixed part after this field) -> 60
-            header_size = 60
-            f.write(struct.pack("<I", header_size))
-            # song length (order list length); we set equal to number of patterns for simplicity
-            song_length = len(patterns)
-            restart_position = 0
-            num_channels = channels
-            num_patterns = len(patterns)
-            num_instruments = len(samples)
-            flags = 0  # 0 = linear periods (we're not using Amiga periods)
-            tempo = tempo
-            bpm = bpm
-            f.write(struct.pack("<H", song_length))
-            f.write(struct.pack("<H", restart_position))
-            f.write(struct.pack("<H", num_channels))
-            f.write(struct.pack("<H", num_patterns))
-            f.write(struct.pack("<H", num_instruments))
-            f.write(struct.pack("<H", flags))
-            f.write(struct.pack("<H", tempo))
-            f.write(struct.pack("<H", bpm))
-            # pattern order table: we write song_length entries; patterns are sequential 0..song_length-1
-            order_table = list(range(song_length))
-            # If order_table shorter than 256, pad with zeros
-            ot = bytes(order_table + [0] * (256 - len(order_table)))
-            f.write(ot)
-
-            # Write patterns
-            for pat in patterns:
-                # pat is rows x channels
-                rows = len(pat)
-                # pattern header length = 9
-                f.write(struct.pack("<I", 9))
-                f.write(struct.pack("<H", rows))
-                # packsize: we need to compute packed pattern data size; we'll write pattern data into buffer first
-                buf = io.BytesIO()
-                for r in range(rows):
-                    for ch in range(num_channels):
-                        cell = pat[r][ch] if ch < len(pat[r]) else None
-                        if cell is None:
-                            # write a 0 byte representing empty note (packed format: 0)
-                            buf.write(b'\x00')
-                        else:
-                            # packed format: set bits for which fields present
-                            # bit 0: note, bit1: instrument, bit2: vol, bit3: effect, bit4: effect param
-                            # But typical XM packed format uses a leading flag byte where bits indicate presence.
-                            # We'll write packed: flag byte followed by fields present.
-                            flag = 0x80
-                            # we'll include note, instrument, volume column, effect and param
-                            flag |= 0x01  # note
-                            flag |= 0x02  # instrument
-                            flag |= 0x04  # volume column
-                            flag |= 0x08  # effect
-                            buf.write(bytes([flag]))
-                            # Note is 1..96; convert to XM note where 0 = no note
-                            note_val = int(cell.get('note', 0))
-                            buf.write(bytes([note_val & 0xFF]))
-                            instr_val = int(cell.get('instrument', 0) & 0xFF)
-                            buf.write(bytes([instr_val]))
-                            # volume column: 0..64
-                            vol = int(cell.get('volume', 64) & 0xFF)
-                            buf.write(bytes([vol]))
-                            # effect and param
-                            eff = int(cell.get('effect', 0) & 0xFF)
-                            effp = int(cell.get('effect_param', 0) & 0xFF)
-                            buf.write(bytes([eff, effp]))
-                packed = buf.getvalue()
-                packed_size = len(packed)
-                f.write(struct.pack("<H", packed_size))
-                f.write(packed)
-
-            # Write instruments
-            # XM instrument header is fairly big; we will write a minimal instrument per sample.
-            for si, sample in enumerate(samples):
-                # instrument name 22 bytes
-                _write_fixed_string(f, f"ins{si+1}", 22)
-                # instrument type (1 byte)
-                f.write(b'\x00')
-                # number of samples in this instrument (we create one sample per instrument)
-                num_smp = 1
-                f.write(struct.pack("<H", num_smp))
-                # sample headers size: 40 * num_smp
-                ins_header_size = 40 * num_smp
-                f.write(struct.pack("<I", ins_header_size))
-                # generate dummy instrument header arrays (envelope etc) — 96 bytes total; we'll zero them
-                f.write(b'\x00' * 96)
-                # write sample headers
-                # For each sample: 40 bytes header
-                pcm = sample
-                if isinstance(pcm, np.ndarray):
-                    data = pcm.tobytes()
-                    length = len(pcm)
-                    # if int16, length is number of samples; we need samplelength (number of samples)
-                    samp_len = pcm.shape[0]
-                    # bytes length:
-                    byte_len = samp_len * 2
-                else:
-                    # fallback: assume bytes
-                    data = sample
-                    byte_len = len(data)
-                    samp_len = byte_len // 2
-
-                # sample length, loop start, loop length
-                f.write(struct.pack("<I", samp_len))
-                f.write(struct.pack("<I", 0))  # loop start
-                f.write(struct.pack("<I", 0))  # loop length
-                # volume (0-64)
-                f.write(bytes([64]))
-                # finetune (signed nibble) - store as signed char - but XM expects signed byte - we'll write 0
-                f.write(bytes([0]))
-                # type (bit0=16bit sample, bit1=loop, loop type etc). We'll set 16-bit flag not in type field but sample packing: set 0x10? For simplicity, set 0x10 for 16-bit
-                # Historically, type byte: bit 4 (0x10) indicates 16-bit sample
-                f.write(bytes([0x10]))
-                # panning
-                f.write(bytes([128]))
-                # relative note number
-                f.write(bytes([0]))
-                # reserved
-                f.write(bytes([0]*1))
-                # sample name 22 bytes
-                _write_fixed_string(f, f"sample{si+1}", 22)
-                # After headers, we now write actual sample data (16-bit signed little endian).
-                # XM expects delta encoded PCM for 16-bit samples; simpler trackers accept raw PCM too; but to be safe we will write raw PCM 16-bit little endian.
-                # Note: the XM format historically expects delta-encoded signed values; some trackers accept raw PCM.
-                # We will write raw little-endian signed 16-bit values.
-                # No extra fields here; sample data comes after all instrument headers. But XM format expects sample data immediately after instrument headers for each instrument, so we'll write it now.
-                # However the spec expects sample data appended after all instruments; many trackers accept immediate write. We'll append sample bytes here.
-                # Convert numpy to little-endian int16 bytes
-                if isinstance(pcm, np.ndarray) and pcm.dtype == np.int16:
-                    f.write(pcm.tobytes())
-                else:
-                    # if PCM is bytes already, write
-                    f.write(data)
+        # the module is collected as a list of chunks (sample data stays in its
+        # NumPy buffer, no concatenation copy) and flushed with one writelines call
+        chunks = []
+        # header size (fixed part after this field) -> 60
+        header_size = 60
+        # song length (order list length); we set equal to number of patterns for simplicity
+        song_length = len(patterns)
+        restart_position = 0
+        num_channels = channels
+        num_patterns = len(patterns)
+        num_instruments = len(samples)
+        flags = 0  # 0 = linear periods (we're not using Amiga periods)
+        # pattern order table: patterns are sequential 0..song_length-1, padded with zeros to 256
+        order_table = bytes(range(song_length))
+        chunks.append(_MODULE_HDR.pack(b"Extended Module: ", _fixed_string(song_name), 0x1A,
+                                _fixed_string("PythonXMWriter"), header_size,
+                                song_length, restart_position, num_channels, num_patterns,
+                                num_instruments, flags, tempo, bpm, order_table))
+
+        # Write patterns
+        for pat in patterns:
+            # pat is a rows x channels CELL_DTYPE array
+            rows = pat.shape[0]
+            # packsize: pattern data is encoded first so its size is known
+            packed = _pack_pattern(pat, num_channels)
+            # pattern header length = 9
+            chunks.append(_PATTERN_HDR.pack(9, rows, len(packed)))
+            chunks.append(packed)
+
+        # Write instruments
+        # XM instrument header is fairly big; we will write a minimal instrument per sample.
+        # one instrument header + one sample header, packed in place for every instrument
+        hdr = bytearray(_INSTR_HDR.size + _SAMPLE_HDR.size)
+        for si, sample in enumerate(samples):
+            pcm = sample
+            if not isinstance(pcm, np.ndarray):
+                # fallback: raw little-endian 16-bit bytes
+                pcm = np.frombuffer(pcm, dtype='<i2')
+            # number of samples (not bytes)
+            samp_len = pcm.shape[0]
+
+            # one sample per instrument; sample headers size is 40 * num_smp
+            num_smp = 1
+            _INSTR_HDR.pack_into(hdr, 0,
+                                 _fixed_string(f"ins{si+1}"),
+                                 0,  # instrument type
+                                 num_smp, _SAMPLE_HDR.size * num_smp)
+            # type bit 4 (0x10) indicates a 16-bit sample; no loop, centre panning
+            _SAMPLE_HDR.pack_into(hdr, _INSTR_HDR.size,
+                                  samp_len, 0, 0,  # length, loop start, loop length
+                                  64,    # volume (0-64)
+                                  0,     # finetune
+                                  0x10,  # type
+                                  128,   # panning
+                                  0,     # relative note number
+                                  0,     # reserved
+                                  _fixed_string(f"sample{si+1}"))
+            chunks.append(bytes(hdr))
+            # Sample data follows its instrument's headers, delta-encoded 16-bit little endian.
+            chunks.append(_delta_encode(pcm).view(np.uint8))
+
+        with open(out_path, "wb", buffering=1 << 20) as f:
+            f.writelines(chunks)
 
         # done
         return
\ No newline at end of file